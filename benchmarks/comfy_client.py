@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Shared ComfyUI client for the Qwen Image 8-Step benchmarks
+Owns the HTTP session, execution-event websocket, workflow cache and result saving
+"""
+
+import asyncio
+import copy
+import functools
+import time
+import uuid
+from datetime import datetime
+
+import aiohttp
+import orjson
+
+@functools.lru_cache(maxsize=None)
+def _read_workflow(workflow_file):
+    """Parse a workflow file once per process; the returned dict is shared"""
+    with open(workflow_file, 'rb') as f:
+        return orjson.loads(f.read())
+
+class ComfyClient:
+    """Async ComfyUI client that the benchmark classes build on"""
+
+    # Default results filename is f"{results_prefix}_{timestamp}.json"
+    results_prefix = "results"
+
+    def __init__(self, base_url="http://localhost:8188"):
+        self.base_url = base_url
+        self.session = None
+        self.client_id = str(uuid.uuid4())
+        self.ws = None
+        self._listener = None
+        self._completions = {}
+        self.results = {}
+
+    async def open(self, pool_size=32):
+        """Open the keep-alive session, check the server and subscribe to execution events"""
+        # One session (and connection pool) shared by every request in a suite
+        connector = aiohttp.TCPConnector(limit=pool_size, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(connector=connector)
+
+        # Check server availability
+        try:
+            async with self.session.get(f"{self.base_url}/system_stats") as response:
+                if response.status != 200:
+                    print("Error: ComfyUI server not responding")
+                    return False
+        except Exception:
+            print("Error: Cannot connect to ComfyUI server")
+            return False
+
+        # Subscribe to execution events before anything is submitted
+        await self.connect_websocket()
+        return True
+
+    async def close(self):
+        """Close the websocket and the HTTP session"""
+        await self.close_websocket()
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def load_test_workflow(self, workflow_file="example-request.json"):
+        """Load the test workflow JSON (cached and shared, copy before modifying)"""
+        try:
+            return _read_workflow(workflow_file)
+        except Exception as e:
+            print(f"Error loading workflow: {e}")
+            return None
+
+    def build_workflow(self, workflow, prompt_text=None):
+        """Build a request body for one prompt from the shared base workflow"""
+        body = copy.deepcopy(workflow)
+
+        # Modify prompt if provided
+        if prompt_text:
+            body["input"]["workflow"]["6"]["inputs"]["text"] = prompt_text
+
+        # Tag the request so execution events are routed to our websocket
+        body["client_id"] = self.client_id
+        return body
+
+    async def submit(self, workflow):
+        """Submit a prebuilt generation request to ComfyUI"""
+        try:
+            async with self.session.post(
+                f"{self.base_url}/prompt",
+                data=orjson.dumps(workflow),
+                headers={"Content-Type": "application/json"}
+            ) as response:
+                if response.status == 200:
+                    prompt_id = orjson.loads(await response.read())["prompt_id"]
+                    # Register before returning so the listener routes this prompt's events;
+                    # events for prompts nobody registered are ignored
+                    if self.ws is not None:
+                        self._completion(prompt_id)
+                    return prompt_id
+                else:
+                    print(f"Error submitting request: {response.status}")
+                    return None
+        except Exception as e:
+            print(f"Error submitting generation: {e}")
+            return None
+
+    async def check_generation_status(self, prompt_id):
+        """Return the prompt's outputs once it appears in /history, else None"""
+        try:
+            async with self.session.get(f"{self.base_url}/history/{prompt_id}") as response:
+                if response.status == 200:
+                    history = orjson.loads(await response.read())
+                    if prompt_id in history:
+                        return history[prompt_id]["outputs"]
+            return None
+        except Exception as e:
+            print(f"Error checking generation status: {e}")
+            return None
+
+    async def connect_websocket(self):
+        """Subscribe to ComfyUI's /ws event stream, falling back to polling if unavailable"""
+        ws_url = self.base_url.replace("http", "ws", 1)
+        try:
+            self.ws = await self.session.ws_connect(f"{ws_url}/ws?clientId={self.client_id}")
+        except Exception as e:
+            print(f"Warning: websocket unavailable, polling /history instead: {e}")
+            self.ws = None
+            return
+        self._listener = asyncio.create_task(self._listen())
+
+    async def close_websocket(self):
+        """Stop the event listener and close the websocket"""
+        if self._listener:
+            self._listener.cancel()
+            self._listener = None
+        if self.ws is not None:
+            await self.ws.close()
+            self.ws = None
+
+    def _completion(self, prompt_id):
+        """Future resolved with (end_time_ns, success) once prompt_id finishes, or None if the websocket drops"""
+        if prompt_id not in self._completions:
+            self._completions[prompt_id] = asyncio.get_running_loop().create_future()
+        return self._completions[prompt_id]
+
+    async def _listen(self):
+        """Resolve completion futures as execution events arrive"""
+        try:
+            async for msg in self.ws:
+                # Binary frames carry latent previews; only text frames are events
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                end_time = time.perf_counter_ns()
+                message = orjson.loads(msg.data)
+                data = message.get("data", {})
+
+                # Only prompts submitted through this client are waited on; trailing events
+                # for prompts whose wait has finished must not leave futures behind
+                completion = self._completions.get(data.get("prompt_id"))
+                if completion is None or completion.done():
+                    continue
+
+                # "executing" with no node means the whole prompt has finished
+                if message["type"] == "execution_success" or (message["type"] == "executing" and data.get("node") is None):
+                    completion.set_result((end_time, True))
+                elif message["type"] in ("execution_error", "execution_interrupted"):
+                    completion.set_result((end_time, False))
+        except Exception as e:
+            print(f"Warning: websocket listener failed, polling /history instead: {e}")
+        else:
+            print("Warning: websocket closed, polling /history instead")
+
+        # Send current and later waits to poll_generation
+        ws, self.ws, self._listener = self.ws, None, None
+        await ws.close()
+        for completion in self._completions.values():
+            if not completion.done():
+                completion.set_result(None)
+
+    async def poll_generation(self, prompt_id, poll_interval=0.1, max_poll_interval=1.0):
+        """Poll /history until prompt_id has outputs (used when the websocket is unavailable)"""
+        # Start fast so short generations return promptly, then back off so long ones don't spam the server
+        while True:
+            if await self.check_generation_status(prompt_id):
+                return time.perf_counter_ns(), True
+            await asyncio.sleep(poll_interval)
+            poll_interval = min(poll_interval * 1.5, max_poll_interval)
+
+    async def wait(self, prompt_id, timeout=60):
+        """Wait for prompt_id to finish; returns (perf_counter_ns end time, success) or raises asyncio.TimeoutError"""
+        deadline = time.monotonic() + timeout
+        try:
+            if self.ws is not None:
+                outcome = await asyncio.wait_for(self._completion(prompt_id), timeout)
+                if outcome is not None:
+                    return outcome
+            # No websocket, or it dropped while we waited: poll for the time that is left
+            return await asyncio.wait_for(self.poll_generation(prompt_id), max(0, deadline - time.monotonic()))
+        finally:
+            self._completions.pop(prompt_id, None)
+
+    async def fetch_image(self, image_info):
+        """Fetch an output image's encoded bytes through ComfyUI's /view endpoint"""
+        params = {
+            "filename": image_info["filename"],
+            "subfolder": image_info.get("subfolder", ""),
+            "type": image_info.get("type", "output")
+        }
+        async with self.session.get(f"{self.base_url}/view", params=params) as response:
+            if response.status == 200:
+                return await response.read()
+        return None
+
+    def save_results(self, filename=None):
+        """Save results to file"""
+        if not filename:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            filename = f"{self.results_prefix}_{timestamp}.json"
+
+        try:
+            with open(filename, 'wb') as f:
+                f.write(orjson.dumps(self.results, option=orjson.OPT_INDENT_2))
+            print(f"\nResults saved to: {filename}")
+        except Exception as e:
+            print(f"Error saving results: {e}")
@@ -4,58 +4,100 @@ Performance benchmarking script for Qwen Image 8-Step Generation
 Tests generation speed, memory usage, and resource utilization
 """
 
+import asyncio
 import time
-import json
-import requests
 import psutil
-import GPUtil
-import statistics
-from datetime import datetime
+import pynvml
+import numpy as np
+import threading
+from collections import deque
 import sys
 import os
 
-class PerformanceBenchmark:
-    def __init__(self, base_url="http://localhost:8188"):
-        self.base_url = base_url
+from comfy_client import ComfyClient
+
+class StatsSampler(threading.Thread):
+    """Background thread that records system stats at a fixed interval"""
+
+    def __init__(self, sample_fn, interval=0.05, max_samples=4096):
+        super().__init__(daemon=True)
+        self.sample_fn = sample_fn
+        self.interval = interval
+        self.samples = deque(maxlen=max_samples)
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while True:
+            self.samples.append(self.sample_fn())
+            if self.stop_event.wait(self.interval):
+                break
+
+    def stop(self):
+        """Stop sampling and wait for the thread to exit"""
+        self.stop_event.set()
+        self.join()
+
+    def peak(self, key):
+        """Maximum recorded value of a stat, or 0 if it was never reported"""
+        values = [sample[key] for sample in self.samples if key in sample]
+        return max(values) if values else 0
+
+    def mean(self, key):
+        """Mean recorded value of a stat, or 0 if it was never reported"""
+        values = [sample[key] for sample in self.samples if key in sample]
+        return float(np.mean(values)) if values else 0
+
+class PerformanceBenchmark(ComfyClient):
+    results_prefix = "benchmark_results"
+
+    def __init__(self, base_url="http://localhost:8188", concurrency=1):
+        super().__init__(base_url)
+        self.concurrency = concurrency
         self.results = {
             "generation_times": [],
             "memory_usage": [],
             "gpu_usage": [],
             "success_rate": 0,
             "total_requests": 0,
-            "failed_requests": 0
+            "failed_requests": 0,
+            "wall_time": 0
         }
 
-    def load_test_workflow(self, workflow_file="example-request.json"):
-        """Load the test workflow JSON"""
+        # Initialize NVML once and reuse the device handle; GPUtil shelled out
+        # to nvidia-smi on every sample
+        self.gpu_handle = None
         try:
-            with open(workflow_file, 'r') as f:
-                return json.load(f)
+            pynvml.nvmlInit()
+            self.gpu_handle = pynvml.nvmlDeviceGetHandleByIndex(0)
         except Exception as e:
-            print(f"Error loading workflow: {e}")
-            return None
+            print(f"Warning: GPU stats unavailable: {e}")
+
+        # Prime the CPU counter so later non-blocking reads cover the time since the previous call
+        psutil.cpu_percent(interval=None)
 
     def get_system_stats(self):
         """Get current system statistics"""
         try:
             # CPU and Memory
             memory = psutil.virtual_memory()
-            cpu_percent = psutil.cpu_percent()
+            cpu_percent = psutil.cpu_percent(interval=None)
 
             # GPU stats if available
             gpu_stats = {}
-            try:
-                gpus = GPUtil.getGPUs()
-                if gpus:
-                    gpu = gpus[0]
+            if self.gpu_handle is not None:
+                try:
+                    gpu_memory = pynvml.nvmlDeviceGetMemoryInfo(self.gpu_handle)
+                    gpu_util = pynvml.nvmlDeviceGetUtilizationRates(self.gpu_handle)
                     gpu_stats = {
-                        "gpu_memory_used": gpu.memoryUsed,
-                        "gpu_memory_total": gpu.memoryTotal,
-                        "gpu_utilization": gpu.load * 100,
-                        "gpu_temperature": gpu.temperature
+                        "gpu_memory_used": gpu_memory.used / (1024**2),
+                        "gpu_memory_total": gpu_memory.total / (1024**2),
+                        "gpu_utilization": gpu_util.gpu,
+                        "gpu_temperature": pynvml.nvmlDeviceGetTemperature(
+                            self.gpu_handle, pynvml.NVML_TEMPERATURE_GPU
+                        )
                     }
-            except:
-                pass
+                except pynvml.NVMLError:
+                    pass
 
             return {
                 "cpu_percent": cpu_percent,
@@ -68,95 +110,73 @@ class PerformanceBenchmark:
             print(f"Error getting system stats: {e}")
             return {}
 
-    def submit_generation(self, workflow, prompt_text=None):
-        """Submit a generation request to ComfyUI"""
-        try:
-            # Modify prompt if provided
-            if prompt_text:
-                workflow["input"]["workflow"]["6"]["inputs"]["text"] = prompt_text
-
-            # Submit request
-            response = requests.post(f"{self.base_url}/prompt", json=workflow)
-            if response.status_code == 200:
-                return response.json()["prompt_id"]
-            else:
-                print(f"Error submitting request: {response.status_code}")
-                return None
-        except Exception as e:
-            print(f"Error submitting generation: {e}")
-            return None
-
-    def check_generation_status(self, prompt_id):
-        """Check if generation is complete"""
-        try:
-            response = requests.get(f"{self.base_url}/history/{prompt_id}")
-            if response.status_code == 200:
-                history = response.json()
-                if prompt_id in history:
-                    return history[prompt_id]["outputs"]
-            return None
-        except Exception as e:
-            print(f"Error checking generation status: {e}")
-            return None
-
-    def measure_generation(self, workflow, prompt_text=None):
+    async def measure_generation(self, workflow):
         """Measure a single generation with timing and resource usage"""
-        start_time = time.time()
-        start_stats = self.get_system_stats()
-
-        # Submit generation
-        prompt_id = self.submit_generation(workflow, prompt_text)
-        if not prompt_id:
-            return None
-
-        # Poll for completion
-        max_wait_time = 60  # Maximum 60 seconds wait
-        poll_interval = 0.5
-        elapsed = 0
-
-        while elapsed < max_wait_time:
-            result = self.check_generation_status(prompt_id)
-            if result:
-                end_time = time.time()
-                end_stats = self.get_system_stats()
+        # Sample stats throughout the generation so peaks are real maxima
+        sampler = StatsSampler(self.get_system_stats)
+        sampler.start()
+        try:
+            start_time = time.perf_counter_ns()
 
-                generation_time = end_time - start_time
+            # Submit generation
+            prompt_id = await self.submit(workflow)
+            if not prompt_id:
+                return None
 
-                # Calculate resource usage
-                memory_delta = end_stats.get("memory_used_gb", 0) - start_stats.get("memory_used_gb", 0)
-                gpu_memory_delta = end_stats.get("gpu_memory_used", 0) - start_stats.get("gpu_memory_used", 0)
+            # Wait for completion
+            max_wait_time = 60  # Maximum 60 seconds wait
 
+            try:
+                end_time, success = await self.wait(prompt_id, max_wait_time)
+            except asyncio.TimeoutError:
+                print(f"Generation timeout for prompt {prompt_id}")
                 return {
-                    "generation_time": generation_time,
-                    "memory_peak": end_stats.get("memory_used_gb", 0),
-                    "memory_delta": memory_delta,
-                    "gpu_memory_peak": end_stats.get("gpu_memory_used", 0),
-                    "gpu_utilization": end_stats.get("gpu_utilization", 0),
-                    "success": True,
-                    "prompt_id": prompt_id
+                    "generation_time": max_wait_time,
+                    "success": False,
+                    "prompt_id": prompt_id,
+                    "error": "timeout"
                 }
+        finally:
+            sampler.stop()
 
-            time.sleep(poll_interval)
-            elapsed += poll_interval
+        if not success:
+            print(f"Generation failed for prompt {prompt_id}")
+            return {
+                "generation_time": (end_time - start_time) / 1e9,
+                "success": False,
+                "prompt_id": prompt_id,
+                "error": "execution_error"
+            }
+
+        generation_time = (end_time - start_time) / 1e9
+
+        # Calculate resource usage
+        start_stats = sampler.samples[0]
+        end_stats = sampler.samples[-1]
+        memory_delta = end_stats.get("memory_used_gb", 0) - start_stats.get("memory_used_gb", 0)
+        gpu_memory_delta = end_stats.get("gpu_memory_used", 0) - start_stats.get("gpu_memory_used", 0)
 
-        # Timeout
-        print(f"Generation timeout for prompt {prompt_id}")
         return {
-            "generation_time": max_wait_time,
-            "success": False,
-            "prompt_id": prompt_id,
-            "error": "timeout"
+            "generation_time": generation_time,
+            "memory_peak": sampler.peak("memory_used_gb"),
+            "memory_delta": memory_delta,
+            "gpu_memory_peak": sampler.peak("gpu_memory_used"),
+            "gpu_utilization": sampler.peak("gpu_utilization"),
+            "gpu_utilization_avg": sampler.mean("gpu_utilization"),
+            "success": True,
+            "prompt_id": prompt_id
         }
 
-    def run_benchmark_suite(self, num_tests=10):
+    async def run_benchmark_suite(self, num_tests=10, workflow_file="example-request.json"):
         """Run a comprehensive benchmark suite"""
         print(f"Running Qwen Image 8-Step Performance Benchmark")
         print(f"Number of tests: {num_tests}")
+        print(f"Concurrency: {self.concurrency}")
         print(f"Base URL: {self.base_url}")
         print("-" * 60)
 
         # Load test workflow
-        workflow = self.load_test_workflow()
+        workflow = self.load_test_workflow(workflow_file)
         if not workflow:
             print("Failed to load test workflow")
             return
@@ -170,142 +190,195 @@ class PerformanceBenchmark:
             "A cozy library with ancient books"
         ]
 
-        # Check server availability
+        # Build one request body per prompt up front; tests only reuse them
+        workflows = [self.build_workflow(workflow, prompt) for prompt in test_prompts]
+
+        # Size the pool so in-flight submissions, polls and the websocket never queue for a socket
         try:
-            response = requests.get(f"{self.base_url}/system_stats")
-            if response.status_code != 200:
-                print("Error: ComfyUI server not responding")
+            if not await self.open(pool_size=max(32, self.concurrency * 2)):
                 return
-        except:
-            print("Error: Cannot connect to ComfyUI server")
-            return
 
-        # Run benchmark tests
-        print("Starting performance tests...")
+            # Run benchmark tests
+            print("Starting performance tests...")
+
+            # Bound the number of in-flight generations to what the server can take
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def run_test(i):
+                async with semaphore:
+                    # Measure generation, rotating through test prompts
+                    result = await self.measure_generation(workflows[i % len(workflows)])
+
+                if result and result.get("success"):
+                    self.results["generation_times"].append(result["generation_time"])
+                    if result.get("memory_peak"):
+                        self.results["memory_usage"].append(result["memory_peak"])
+                    if result.get("gpu_utilization"):
+                        self.results["gpu_usage"].append(result["gpu_utilization"])
+                    self.results["total_requests"] += 1
+                    print(f"Test {i+1}/{num_tests}... ✅ {result['generation_time']:.2f}s")
+                else:
+                    self.results["failed_requests"] += 1
+                    self.results["total_requests"] += 1
+                    print(f"Test {i+1}/{num_tests}... ❌ Failed")
+
+            suite_start = time.perf_counter_ns()
+            await asyncio.gather(*[run_test(i) for i in range(num_tests)])
+            self.results["wall_time"] = (time.perf_counter_ns() - suite_start) / 1e9
+        finally:
+            await self.close()
+
+        # Summarize only once every timing sample is in, then report
+        self.print_report(self.compute_statistics())
+
+    def compute_statistics(self):
+        """Calculate benchmark statistics as a structured dict, also stored in the results"""
+        total = self.results["total_requests"]
+        successful = total - self.results["failed_requests"]
+
+        # Success rate
+        if total > 0:
+            self.results["success_rate"] = successful / total * 100
+
+        stats = {
+            "total_requests": total,
+            "successful": successful,
+            "failed": self.results["failed_requests"],
+            "success_rate": self.results["success_rate"],
+            "wall_time": self.results["wall_time"]
+        }
+
+        # Generation time statistics
+        if self.results["generation_times"]:
+            times = np.asarray(self.results["generation_times"], dtype=np.float64)
+            stats["generation_time"] = {
+                "mean": float(times.mean()),
+                "median": float(np.median(times)),
+                "min": float(times.min()),
+                "max": float(times.max()),
+                "std": float(times.std(ddof=1)) if times.size > 1 else 0.0
+            }
+
+        # Memory usage statistics
+        if self.results["memory_usage"]:
+            memory = np.asarray(self.results["memory_usage"], dtype=np.float64)
+            stats["memory_gb"] = {
+                "mean": float(memory.mean()),
+                "peak": float(memory.max()),
+                "min": float(memory.min())
+            }
+
+        # GPU utilization statistics
+        if self.results["gpu_usage"]:
+            gpu = np.asarray(self.results["gpu_usage"], dtype=np.float64)
+            stats["gpu_utilization"] = {
+                "mean": float(gpu.mean()),
+                "peak": float(gpu.max()),
+                "min": float(gpu.min())
+            }
+
+        stats["assessment"] = self.assess_performance(stats)
+        self.results["statistics"] = stats
+        return stats
 
-        for i in range(num_tests):
-            print(f"Test {i+1}/{num_tests}...", end=" ")
+    def assess_performance(self, stats):
+        """Rate performance against the benchmark targets"""
+        assessment = {"ready_for_production": False}
 
-            # Rotate through test prompts
-            prompt = test_prompts[i % len(test_prompts)]
+        if "generation_time" in stats:
+            avg_time = stats["generation_time"]["mean"]
 
-            # Measure generation
-            result = self.measure_generation(workflow, prompt)
+            # Time assessment
+            if avg_time < 3:
+                assessment["speed"] = "EXCELLENT"
+            elif avg_time < 5:
+                assessment["speed"] = "GOOD"
+            elif avg_time < 8:
+                assessment["speed"] = "ACCEPTABLE"
+            else:
+                assessment["speed"] = "NEEDS IMPROVEMENT"
 
-            if result and result.get("success"):
-                self.results["generation_times"].append(result["generation_time"])
-                if result.get("memory_peak"):
-                    self.results["memory_usage"].append(result["memory_peak"])
-                if result.get("gpu_utilization"):
-                    self.results["gpu_usage"].append(result["gpu_utilization"])
-                self.results["total_requests"] += 1
-                print(f"✅ {result['generation_time']:.2f}s")
+            # Success rate assessment
+            if stats["success_rate"] >= 95:
+                assessment["success_rate"] = "EXCELLENT"
+            elif stats["success_rate"] >= 90:
+                assessment["success_rate"] = "GOOD"
+            elif stats["success_rate"] >= 80:
+                assessment["success_rate"] = "ACCEPTABLE"
             else:
-                self.results["failed_requests"] += 1
-                self.results["total_requests"] += 1
-                print(f"❌ Failed")
+                assessment["success_rate"] = "NEEDS IMPROVEMENT"
 
-        # Calculate statistics
-        self.calculate_statistics()
+            # Overall assessment
+            assessment["ready_for_production"] = avg_time < 5 and stats["success_rate"] >= 90
 
-    def calculate_statistics(self):
-        """Calculate and display benchmark statistics"""
+        return assessment
+
+    def print_report(self, stats):
+        """Display benchmark statistics computed by compute_statistics"""
         print("\n" + "=" * 60)
         print("BENCHMARK RESULTS")
         print("=" * 60)
 
-        # Success rate
-        if self.results["total_requests"] > 0:
-            self.results["success_rate"] = (self.results["total_requests"] - self.results["failed_requests"]) / self.results["total_requests"] * 100
-
-        print(f"Total Requests: {self.results['total_requests']}")
-        print(f"Successful: {self.results['total_requests'] - self.results['failed_requests']}")
-        print(f"Failed: {self.results['failed_requests']}")
-        print(f"Success Rate: {self.results['success_rate']:.1f}%")
+        print(f"Total Requests: {stats['total_requests']}")
+        print(f"Successful: {stats['successful']}")
+        print(f"Failed: {stats['failed']}")
+        print(f"Success Rate: {stats['success_rate']:.1f}%")
+        print(f"Wall Time: {stats['wall_time']:.2f}s")
         print()
 
-        # Generation time statistics
-        if self.results["generation_times"]:
-            times = self.results["generation_times"]
+        if "generation_time" in stats:
+            times = stats["generation_time"]
             print("Generation Time Statistics:")
-            print(f"  Average: {statistics.mean(times):.2f}s")
-            print(f"  Median:  {statistics.median(times):.2f}s")
-            print(f"  Min:     {min(times):.2f}s")
-            print(f"  Max:     {max(times):.2f}s")
-            print(f"  Std Dev: {statistics.stdev(times) if len(times) > 1 else 0:.2f}s")
+            print(f"  Average: {times['mean']:.2f}s")
+            print(f"  Median:  {times['median']:.2f}s")
+            print(f"  Min:     {times['min']:.2f}s")
+            print(f"  Max:     {times['max']:.2f}s")
+            print(f"  Std Dev: {times['std']:.2f}s")
             print()
 
-        # Memory usage statistics
-        if self.results["memory_usage"]:
-            memory = self.results["memory_usage"]
+        if "memory_gb" in stats:
+            memory = stats["memory_gb"]
             print("Memory Usage Statistics:")
-            print(f"  Average: {statistics.mean(memory):.1f} GB")
-            print(f"  Peak:    {max(memory):.1f} GB")
-            print(f"  Min:     {min(memory):.1f} GB")
+            print(f"  Average: {memory['mean']:.1f} GB")
+            print(f"  Peak:    {memory['peak']:.1f} GB")
+            print(f"  Min:     {memory['min']:.1f} GB")
             print()
 
-        # GPU utilization statistics
-        if self.results["gpu_usage"]:
-            gpu = self.results["gpu_usage"]
+        if "gpu_utilization" in stats:
+            gpu = stats["gpu_utilization"]
             print("GPU Utilization Statistics:")
-            print(f"  Average: {statistics.mean(gpu):.1f}%")
-            print(f"  Peak:    {max(gpu):.1f}%")
-            print(f"  Min:     {min(gpu):.1f}%")
+            print(f"  Average: {gpu['mean']:.1f}%")
+            print(f"  Peak:    {gpu['peak']:.1f}%")
+            print(f"  Min:     {gpu['min']:.1f}%")
             print()
 
         # Performance assessment
-        self.assess_performance()
-
-    def assess_performance(self):
-        """Assess performance against benchmarks"""
+        assessment = stats["assessment"]
         print("Performance Assessment:")
         print("-" * 30)
 
-        if self.results["generation_times"]:
-            avg_time = statistics.mean(self.results["generation_times"])
-
-            # Time assessment
-            if avg_time < 3:
-                print("⚡ Generation Speed: EXCELLENT (<3s)")
-            elif avg_time < 5:
-                print("✅ Generation Speed: GOOD (3-5s)")
-            elif avg_time < 8:
-                print("⚠️  Generation Speed: ACCEPTABLE (5-8s)")
-            else:
-                print("❌ Generation Speed: NEEDS IMPROVEMENT (>8s)")
-
-            # Success rate assessment
-            if self.results["success_rate"] >= 95:
-                print("✅ Success Rate: EXCELLENT (≥95%)")
-            elif self.results["success_rate"] >= 90:
-                print("✅ Success Rate: GOOD (90-95%)")
-            elif self.results["success_rate"] >= 80:
-                print("⚠️  Success Rate: ACCEPTABLE (80-90%)")
-            else:
-                print("❌ Success Rate: NEEDS IMPROVEMENT (<80%)")
+        speed_labels = {
+            "EXCELLENT": "⚡ Generation Speed: EXCELLENT (<3s)",
+            "GOOD": "✅ Generation Speed: GOOD (3-5s)",
+            "ACCEPTABLE": "⚠️  Generation Speed: ACCEPTABLE (5-8s)",
+            "NEEDS IMPROVEMENT": "❌ Generation Speed: NEEDS IMPROVEMENT (>8s)"
+        }
+        success_labels = {
+            "EXCELLENT": "✅ Success Rate: EXCELLENT (≥95%)",
+            "GOOD": "✅ Success Rate: GOOD (90-95%)",
+            "ACCEPTABLE": "⚠️  Success Rate: ACCEPTABLE (80-90%)",
+            "NEEDS IMPROVEMENT": "❌ Success Rate: NEEDS IMPROVEMENT (<80%)"
+        }
+        if "speed" in assessment:
+            print(speed_labels[assessment["speed"]])
+            print(success_labels[assessment["success_rate"]])
 
-        # Overall assessment
         print()
-        if (self.results["generation_times"] and
-            statistics.mean(self.results["generation_times"]) < 5 and
-            self.results["success_rate"] >= 90):
+        if assessment["ready_for_production"]:
             print("🎉 OVERALL: READY FOR PRODUCTION")
         else:
             print("⚠️  OVERALL: NEEDS OPTIMIZATION")
 
-    def save_results(self, filename=None):
-        """Save benchmark results to file"""
-        if not filename:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"benchmark_results_{timestamp}.json"
-
-        try:
-            with open(filename, 'w') as f:
-                json.dump(self.results, f, indent=2)
-            print(f"\nResults saved to: {filename}")
-        except Exception as e:
-            print(f"Error saving results: {e}")
-
 def main():
     """Main function"""
     import argparse
@@ -313,14 +386,15 @@ def main():
     parser = argparse.ArgumentParser(description="Qwen Image 8-Step Performance Benchmark")
     parser.add_argument("--url", default="http://localhost:8188", help="ComfyUI server URL")
     parser.add_argument("--tests", type=int, default=10, help="Number of tests to run")
+    parser.add_argument("--concurrency", type=int, default=1, help="Maximum number of generations in flight")
     parser.add_argument("--output", help="Output file for results")
     parser.add_argument("--workflow", default="example-request.json", help="Test workflow file")
 
     args = parser.parse_args()
 
     # Create and run benchmark
-    benchmark = PerformanceBenchmark(args.url)
-    benchmark.run_benchmark_suite(args.tests)
+    benchmark = PerformanceBenchmark(args.url, args.concurrency)
+    asyncio.run(benchmark.run_benchmark_suite(args.tests, args.workflow))
 
     # Save results
     benchmark.save_results(args.output)
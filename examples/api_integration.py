@@ -5,7 +5,13 @@ Advanced integration with error handling, retries, and batch processing
 """
 
 import requests
-import json
+from requests.adapters import HTTPAdapter
+import atexit
+import functools
+import orjson
+import queue
+import random
+import threading
 import time
 import os
 from typing import List, Dict, Optional, Union
@@ -17,6 +23,48 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Responses where the server refused the prompt, so resubmitting cannot queue it twice;
+# a 500/502/504 may arrive after ComfyUI already queued it and is treated as final
+RETRYABLE_STATUS_CODES = {429, 503}
+
+# Bulk /history polls request only this many entries beyond the prompts still pending
+HISTORY_WINDOW_MARGIN = 16
+
+@functools.lru_cache(maxsize=8)
+def _load_workflow_cached(workflow_file: str, mtime_ns: int) -> Dict:
+    """Parse a workflow file once per modification time; the returned dict is shared"""
+    with open(workflow_file, 'rb') as f:
+        return orjson.loads(f.read())
+
+# Generation info files are written by one background thread so callers never block on disk
+_write_queue = queue.Queue()
+
+def _write_generation_info():
+    """Drain queued (filename, encoded JSON) writes"""
+    while True:
+        filename, data = _write_queue.get()
+        try:
+            with open(filename, 'wb') as f:
+                f.write(data)
+        except OSError as e:
+            logger.error(f"Error saving generation info to {filename}: {e}")
+        finally:
+            _write_queue.task_done()
+
+_writer_lock = threading.Lock()
+_writer_started = False
+
+def _queue_generation_info(filename: str, data: bytes):
+    """Queue a write, starting the writer thread on first use"""
+    global _writer_started
+    with _writer_lock:
+        if not _writer_started:
+            threading.Thread(target=_write_generation_info, name="generation-info-writer", daemon=True).start()
+            # Finish pending writes before the interpreter exits
+            atexit.register(_write_queue.join)
+            _writer_started = True
+    _write_queue.put((filename, data))
+
 @dataclass
 class GenerationRequest:
     """Data class for generation requests"""
@@ -44,19 +92,35 @@ class QwenImageAPI:
         self,
         base_url: str = "http://localhost:8188",
         timeout: int = 60,
-        max_retries: int = 3,
-        retry_delay: float = 1.0
+        max_retries: int = 5,
+        retry_delay: float = 0.1,
+        max_retry_delay: float = 30.0,
+        pool_size: int = 32,
+        max_inflight: int = 8
     ):
         self.base_url = base_url
         self.timeout = timeout
         self.max_retries = max_retries
         self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        # Throttle only when the server pushes back: submissions are capped at max_inflight,
+        # and after a 429 every caller holds off until the cooldown expires
+        self._limiter = threading.BoundedSemaphore(max_inflight)
+        self._cooldown_until = 0.0
         self.session = requests.Session()
 
+        # Keep enough pooled sockets that submits and history polls never reconnect;
+        # retries are handled explicitly in submit_generation
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
         # Connection settings
         self.session.headers.update({
             'Content-Type': 'application/json',
-            'User-Agent': 'QwenImageAPIClient/1.0'
+            'User-Agent': 'QwenImageAPIClient/1.0',
+            'Connection': 'keep-alive'
         })
 
     def health_check(self) -> bool:
@@ -71,10 +135,10 @@ class QwenImageAPI:
             return False
 
     def load_workflow(self, workflow_file: str = "../example-request.json") -> Optional[Dict]:
-        """Load and validate the ComfyUI workflow"""
+        """Load and validate the ComfyUI workflow (cached and shared, never mutate it)"""
         try:
-            with open(workflow_file, 'r') as f:
-                workflow = json.load(f)
+            # Keyed on mtime, so repeat calls cost one stat() yet still see edits to the file
+            workflow = _load_workflow_cached(workflow_file, os.stat(workflow_file).st_mtime_ns)
 
             # Validate workflow structure
             if "input" not in workflow or "workflow" not in workflow["input"]:
@@ -84,7 +148,7 @@ class QwenImageAPI:
         except FileNotFoundError:
             logger.error(f"Workflow file {workflow_file} not found")
             return None
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error(f"Invalid JSON in workflow file: {e}")
             return None
         except Exception as e:
@@ -96,58 +160,143 @@ class QwenImageAPI:
         base_workflow: Dict,
         request: GenerationRequest
     ) -> Dict:
-        """Prepare workflow with request parameters"""
-        workflow = json.loads(json.dumps(base_workflow))  # Deep copy
-
-        # Update prompt
-        workflow["input"]["workflow"]["6"]["inputs"]["text"] = request.prompt
+        """Prepare workflow with request parameters, copying only the patched nodes"""
+        base = base_workflow["input"]["workflow"]
+
+        def patch(node_id, **inputs):
+            return {**base[node_id], "inputs": {**base[node_id]["inputs"], **inputs}}
+
+        # Every other node is shared with the base workflow, which is never mutated
+        nodes = {
+            **base,
+            # Update prompt
+            "6": patch("6", text=request.prompt),
+            # Update generation parameters
+            "3": patch(
+                "3",
+                seed=request.seed if request.seed else int(time.time() * 1000) % 2**32,
+                steps=request.steps,
+                cfg=request.cfg_scale
+            ),
+            # Update image dimensions
+            "58": patch(
+                "58",
+                width=request.width,
+                height=request.height,
+                batch_size=request.batch_size
+            )
+        }
 
-        # Update generation parameters
-        workflow["input"]["workflow"]["3"]["inputs"].update({
-            "seed": request.seed if request.seed else int(time.time() * 1000) % 2**32,
-            "steps": request.steps,
-            "cfg": request.cfg_scale
-        })
+        return {**base_workflow, "input": {**base_workflow["input"], "workflow": nodes}}
 
-        # Update image dimensions
-        workflow["input"]["workflow"]["58"]["inputs"].update({
-            "width": request.width,
-            "height": request.height,
-            "batch_size": request.batch_size
-        })
+    def backoff_delay(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        """Delay before the next attempt: the server's Retry-After if given, else jittered exponential backoff"""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                # Capped too: a 429's delay becomes the cooldown shared by every caller
+                return min(self.max_retry_delay, float(retry_after))
 
-        return workflow
+        # Randomize around the exponential step so concurrent clients don't retry in sync
+        return min(self.max_retry_delay, self.retry_delay * 2 ** attempt * (0.5 + random.random()))
 
     def submit_generation(self, workflow: Dict) -> Optional[str]:
         """Submit generation request with retry logic"""
         for attempt in range(self.max_retries):
+            cooldown = self._cooldown_until - time.monotonic()
+            if cooldown > 0:
+                time.sleep(cooldown)
+
             try:
-                response = self.session.post(
-                    f"{self.base_url}/prompt",
-                    json=workflow,
-                    timeout=10
-                )
+                with self._limiter:
+                    response = self.session.post(
+                        f"{self.base_url}/prompt",
+                        data=orjson.dumps(workflow),
+                        timeout=10
+                    )
 
                 if response.status_code == 200:
-                    return response.json()["prompt_id"]
-                elif response.status_code == 429:  # Rate limited
-                    logger.warning(f"Rate limited, retrying in {self.retry_delay}s...")
-                    time.sleep(self.retry_delay * (attempt + 1))
+                    return orjson.loads(response.content)["prompt_id"]
+                elif response.status_code in RETRYABLE_STATUS_CODES:
+                    delay = self.backoff_delay(attempt, response)
+                    if response.status_code == 429:
+                        self._cooldown_until = max(self._cooldown_until, time.monotonic() + delay)
+                    logger.warning(f"Submit got {response.status_code}, retrying in {delay:.2f}s...")
                 else:
                     logger.error(f"Submit failed: {response.status_code} - {response.text}")
+                    return None
 
+            except requests.exceptions.ReadTimeout as e:
+                # The request reached the server, which may have queued it
+                logger.error(f"Submit timed out waiting for a response: {e}")
+                return None
             except requests.exceptions.RequestException as e:
+                delay = self.backoff_delay(attempt)
                 logger.warning(f"Attempt {attempt + 1} failed: {e}")
-                if attempt < self.max_retries - 1:
-                    time.sleep(self.retry_delay * (attempt + 1))
+
+            if attempt < self.max_retries - 1:
+                time.sleep(delay)
 
         return None
 
+    def extract_images(self, generation_data: Dict) -> List[Dict]:
+        """Collect image information from every output node of a history entry"""
+        images = []
+        for node_id, node_output in generation_data.get("outputs", {}).items():
+            if "images" in node_output:
+                images.extend(node_output["images"])
+        return images
+
+    def execution_time(self, status: Dict) -> Optional[float]:
+        """Seconds ComfyUI spent executing a prompt, from its history status messages"""
+        timestamps = {event: data.get("timestamp") for event, data in status.get("messages", [])}
+        start, end = timestamps.get("execution_start"), timestamps.get("execution_success")
+        if start is None or end is None:
+            return None
+        return (end - start) / 1000
+
+    def history_result(
+        self,
+        prompt_id: str,
+        generation_data: Dict,
+        generation_time: float
+    ) -> Optional[GenerationResult]:
+        """Turn a history entry into a result, or None if ComfyUI is still executing it"""
+        # Older ComfyUI builds have no status block; their entries only appear once execution ends
+        status = generation_data.get("status", {})
+        if status.get("status_str") == "error":
+            error = "execution error"
+            for event, data in status.get("messages", []):
+                if event == "execution_error":
+                    error = f"execution error: {data.get('exception_message', '').strip()}"
+            return GenerationResult(
+                success=False,
+                prompt_id=prompt_id,
+                generation_time=generation_time,
+                error=error
+            )
+        if status and not status.get("completed"):
+            return None
+
+        # The caller's time since submission includes waiting behind earlier prompts;
+        # prefer the execution time the server recorded
+        execution_time = self.execution_time(status)
+        if execution_time is not None:
+            generation_time = execution_time
+
+        return GenerationResult(
+            success=True,
+            prompt_id=prompt_id,
+            generation_time=generation_time,
+            images=self.extract_images(generation_data)
+        )
+
     def wait_for_completion(self, prompt_id: str) -> GenerationResult:
         """Wait for generation completion with timeout"""
-        start_time = time.time()
+        start_time = time.monotonic()
+        poll_interval = 0.1
 
-        while time.time() - start_time < self.timeout:
+        while time.monotonic() - start_time < self.timeout:
             try:
                 response = self.session.get(
                     f"{self.base_url}/history/{prompt_id}",
@@ -155,27 +304,17 @@ class QwenImageAPI:
                 )
 
                 if response.status_code == 200:
-                    history = response.json()
+                    history = orjson.loads(response.content)
 
                     if prompt_id in history:
-                        generation_data = history[prompt_id]
-                        outputs = generation_data.get("outputs", {})
-
-                        # Extract image information
-                        images = []
-                        for node_id, node_output in outputs.items():
-                            if "images" in node_output:
-                                images.extend(node_output["images"])
+                        # Stop as soon as the entry reports completion or an error
+                        result = self.history_result(prompt_id, history[prompt_id], time.monotonic() - start_time)
+                        if result:
+                            return result
 
-                        generation_time = time.time() - start_time
-                        return GenerationResult(
-                            success=True,
-                            prompt_id=prompt_id,
-                            generation_time=generation_time,
-                            images=images
-                        )
-
-                time.sleep(1)  # Poll every second
+                # Poll fast at first, backing off to once a second; jitter desynchronizes clients
+                time.sleep(poll_interval + random.uniform(0, 0.05))
+                poll_interval = min(poll_interval * 1.5, 1.0)
 
             except requests.exceptions.RequestException as e:
                 logger.error(f"Error checking generation status: {e}")
@@ -215,18 +354,107 @@ class QwenImageAPI:
         logger.info(f"Generation submitted with ID: {prompt_id}")
         return self.wait_for_completion(prompt_id)
 
+    def submit_all(self, requests: List[GenerationRequest]) -> List[Optional[str]]:
+        """Queue every request with ComfyUI up front; None marks a failed submission"""
+        workflow = self.load_workflow()
+        if not workflow:
+            return [None] * len(requests)
+
+        prompt_ids = []
+        for i, request in enumerate(requests, 1):
+            logger.info(f"Submitting request {i}/{len(requests)}: {request.prompt[:50]}...")
+            prompt_ids.append(self.submit_generation(self.prepare_workflow(workflow, request)))
+        return prompt_ids
+
+    def fetch_history_entry(self, prompt_id: str) -> Dict:
+        """Fetch one prompt's history; empty until it has finished"""
+        response = self.session.get(f"{self.base_url}/history/{prompt_id}", timeout=5)
+        if response.status_code == 200:
+            return orjson.loads(response.content)
+        return {}
+
+    def poll_history_multi(self, prompt_ids: List[str]) -> Dict[str, GenerationResult]:
+        """Wait for many prompts at once by polling the bulk /history endpoint"""
+        start_time = time.monotonic()
+        pending = set(prompt_ids)
+        results = {}
+
+        # The timeout is a stall timeout: it restarts whenever any prompt completes
+        last_progress = start_time
+        poll_interval = 0.1
+
+        # Only parse the bulk history when it has changed
+        etag = None
+        last_body = None
+        window = None
+        while pending and time.monotonic() - last_progress < self.timeout:
+            history = {}
+            try:
+                # ComfyUI keeps up to 10k entries; ask only for the newest few, which hold
+                # ours unless other clients' jobs crowd them out
+                max_items = len(pending) + HISTORY_WINDOW_MARGIN
+                headers = {"If-None-Match": etag} if etag else None
+                response = self.session.get(
+                    f"{self.base_url}/history",
+                    params={"max_items": max_items},
+                    headers=headers,
+                    timeout=5
+                )
+                # 304 means unchanged; servers without ETags are caught by comparing bodies
+                if response.status_code == 200 and response.content != last_body:
+                    etag = response.headers.get("ETag")
+                    last_body = response.content
+                    history = orjson.loads(last_body)
+
+                    # History is append-ordered, so a window sharing an entry with the previous one
+                    # holds everything finished since; only a window that turned over completely
+                    # may have pushed prompts out, and those are looked up one by one
+                    turned_over = window is not None and len(history) >= max_items and window.isdisjoint(history)
+                    window = set(history)
+                    if turned_over:
+                        for prompt_id in pending - window:
+                            history.update(self.fetch_history_entry(prompt_id))
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"Error polling history: {e}")
+
+            for prompt_id in pending & history.keys():
+                result = self.history_result(prompt_id, history[prompt_id], time.monotonic() - start_time)
+                if not result:
+                    continue
+                results[prompt_id] = result
+                last_progress = time.monotonic()
+                poll_interval = 0.1
+            pending -= results.keys()
+
+            if pending:
+                # Poll fast at first, backing off to once a second; jitter desynchronizes clients
+                time.sleep(poll_interval + random.uniform(0, 0.05))
+                poll_interval = min(poll_interval * 1.5, 1.0)
+
+        for prompt_id in pending:
+            results[prompt_id] = GenerationResult(
+                success=False,
+                prompt_id=prompt_id,
+                generation_time=time.monotonic() - start_time,
+                error="timeout"
+            )
+        return results
+
     def batch_generate(self, requests: List[GenerationRequest]) -> List[GenerationResult]:
-        """Generate multiple images in sequence"""
+        """Generate multiple images: queue them all, then reap completions in bulk"""
         logger.info(f"Starting batch generation of {len(requests)} images")
 
-        results = []
-        for i, request in enumerate(requests, 1):
-            logger.info(f"Processing request {i}/{len(requests)}")
-            result = self.generate_image(request)
-            results.append(result)
+        # ComfyUI runs queued prompts back to back, so submit everything before waiting
+        prompt_ids = self.submit_all(requests)
+        completed = self.poll_history_multi([prompt_id for prompt_id in prompt_ids if prompt_id])
 
-            # Small delay between requests to prevent overwhelming
-            time.sleep(0.5)
+        results = [
+            completed[prompt_id] if prompt_id else GenerationResult(
+                success=False,
+                error="Failed to submit generation request"
+            )
+            for prompt_id in prompt_ids
+        ]
 
         successful = sum(1 for r in results if r.success)
         logger.info(f"Batch completed: {successful}/{len(requests)} successful")
@@ -234,9 +462,11 @@ class QwenImageAPI:
         return results
 
     def save_generation_info(self, result: GenerationResult, filename: str = None) -> str:
-        """Save generation result information to file"""
+        """Queue generation result information to be saved to file; returns the filename"""
+        now = datetime.now()
         if not filename:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            # Microseconds keep saves made within the same second from overwriting each other
+            timestamp = now.strftime("%Y%m%d_%H%M%S_%f")
             filename = f"generation_{timestamp}.json"
 
         result_data = {
@@ -245,11 +475,11 @@ class QwenImageAPI:
             "generation_time": result.generation_time,
             "images": result.images,
             "error": result.error,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": now.isoformat()
         }
 
-        with open(filename, 'w') as f:
-            json.dump(result_data, f, indent=2)
+        # Encode now so later changes to the result can't leak into the file
+        _queue_generation_info(filename, orjson.dumps(result_data, option=orjson.OPT_INDENT_2))
 
         return filename
 
@@ -309,11 +539,12 @@ def main():
         )
     ]
 
+    batch_start = time.monotonic()
     batch_results = api.batch_generate(batch_requests)
+    total_time = time.monotonic() - batch_start
 
     # Batch results summary
     successful = sum(1 for r in batch_results if r.success)
-    total_time = sum(r.generation_time for r in batch_results if r.success)
 
     print(f"\n📊 Batch Summary:")
     print(f"   Successful: {successful}/{len(batch_results)}")
@@ -4,104 +4,387 @@ Quick Start Example for Qwen Image 8-Step Generation
 Basic API integration example for rapid image generation
 """
 
+import concurrent.futures
+import copy
+import functools
+import hashlib
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import websocket
+import orjson
+import random
 import time
+import uuid
 import os
-from datetime import datetime
+import pathlib
+
+try:
+    import diskcache
+except ImportError:  # Optional: results are not reused between runs
+    diskcache = None
+
+@functools.lru_cache(maxsize=8)
+def _list_dir(path):
+    """Names in a directory (cached; empty if it doesn't exist)"""
+    try:
+        return frozenset(os.listdir(path))
+    except OSError:
+        return frozenset()
 
 class QwenImageGenerator:
-    def __init__(self, base_url="http://localhost:8188", timeout=60):
+    # Fixed attribute set; no per-instance __dict__
+    __slots__ = ("base_url", "timeout", "session", "client_id", "ws", "_finished",
+                 "_submitted", "_workflow_cache", "_io_pool", "cache", "_warmed_up")
+
+    # Common output paths (adjust based on your ComfyUI setup)
+    _OUTPUT_DIRS = tuple(pathlib.Path(p) for p in ["../output", "output", "/comfyui/output", "."])
+
+    def __init__(self, base_url="http://localhost:8188", timeout=60, cache_dir=".qwen_cache"):
         self.base_url = base_url
         self.timeout = timeout
         self.session = requests.Session()
 
+        # Reuse pooled keep-alive connections and retry transient gateway errors. Only GETs are
+        # retried: a 502/504 on POST /prompt may arrive after the prompt was already queued
+        adapter = HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=64,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.2,
+                status_forcelist=[502, 503, 504],
+                allowed_methods=["GET"]
+            )
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "Connection": "keep-alive",
+            "Accept-Encoding": "gzip, deflate"
+        })
+        # Execution events for prompts tagged with client_id are pushed over /ws
+        self.client_id = str(uuid.uuid4())
+        self.ws = None
+        # Outcomes seen on /ws for prompts other than the one being waited on
+        self._finished = {}
+        # Submission time of each queued prompt, for servers whose history has no execution timestamps
+        self._submitted = {}
+        # Parsed workflows keyed by absolute path, with the mtime they were read at
+        self._workflow_cache = {}
+        # Worker threads for per-image filesystem work in get_image_info
+        self._io_pool = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+        # On-disk results of earlier identical requests (needs diskcache; cache_dir=None disables)
+        self.cache = diskcache.Cache(cache_dir) if diskcache is not None and cache_dir else None
+        # Set once the first submit has opened a pooled connection
+        self._warmed_up = False
+
     def load_workflow(self, workflow_file="../example-request.json"):
-        """Load the ComfyUI workflow"""
+        """Load the ComfyUI workflow (parsed once per file, returns a private copy)"""
         try:
-            with open(workflow_file, 'r') as f:
-                return json.load(f)
+            key = os.path.abspath(workflow_file)
+            mtime = os.stat(key).st_mtime_ns
+            cached = self._workflow_cache.get(key)
+            # Re-read only if the file changed since it was cached
+            if cached is None or cached[0] != mtime:
+                with open(key, 'rb') as f:
+                    cached = self._workflow_cache[key] = (mtime, orjson.loads(f.read()))
+            # Callers patch the prompt and seed in place, so never hand out the cached dict
+            return copy.deepcopy(cached[1])
         except FileNotFoundError:
             print(f"Error: Workflow file {workflow_file} not found")
             return None
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             print(f"Error: Invalid JSON in workflow file {workflow_file}")
             return None
 
-    def generate_image(self, prompt, seed=None, workflow_file="../example-request.json"):
-        """Generate an image from text prompt"""
-        print(f"🎨 Generating image: {prompt[:50]}...")
+    def connect_websocket(self):
+        """Open ComfyUI's /ws event stream on first use; returns None if it is unavailable"""
+        if self.ws is None:
+            ws_url = self.base_url.replace("http", "ws", 1)
+            try:
+                self.ws = websocket.create_connection(
+                    f"{ws_url}/ws?clientId={self.client_id}",
+                    timeout=self.timeout
+                )
+            except (websocket.WebSocketException, OSError) as e:
+                print(f"⚠️  WebSocket unavailable, polling for results instead: {e}")
+        return self.ws
+
+    def close_websocket(self):
+        """Close the event stream so the next wait reconnects or polls"""
+        if self.ws is not None:
+            self.ws.close()
+            self.ws = None
+
+    def close(self):
+        """Close the event stream, the pooled HTTP connections and the I/O threads"""
+        self.close_websocket()
+        self.session.close()
+        self._io_pool.shutdown(wait=True)
+        if self.cache is not None:
+            self.cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def input_handles(self, workflow):
+        """The text encoder (node 6) and sampler (node 3) input dicts patched per request"""
+        nodes = workflow["input"]["workflow"]
+        return nodes["6"]["inputs"], nodes["3"]["inputs"]
+
+    def request_key(self, workflow):
+        """Content hash of the server plus a request's workflow graph, prompt and seed (client_id excluded)"""
+        return hashlib.blake2b(
+            orjson.dumps([self.base_url, workflow["input"]], option=orjson.OPT_SORT_KEYS)
+        ).hexdigest()
+
+    def cached_prompt_id(self, workflow):
+        """prompt_id of an identical earlier request whose result is cached, else None"""
+        if self.cache is None:
+            return None
+        prompt_id = self.cache.get(self.request_key(workflow))
+        # Only failed or unfinished generations lack a stored result
+        if prompt_id is not None and prompt_id in self.cache:
+            print(f"♻️  Reusing cached result: {prompt_id}")
+            return prompt_id
+        return None
 
+    def remember(self, workflow, prompt_id):
+        """Map a submitted request to its prompt_id so its result can be reused"""
+        if self.cache is not None:
+            self.cache[self.request_key(workflow)] = prompt_id
+
+    def store_result(self, result):
+        """Cache a successful result under its prompt_id and return it"""
+        if self.cache is not None:
+            self.cache[result["prompt_id"]] = result
+        return result
+
+    def build_request(self, prompt, seed=None, workflow_file="../example-request.json"):
+        """Build the /prompt request body for one prompt, or None if the workflow can't be loaded"""
         # Load workflow
         workflow = self.load_workflow(workflow_file)
         if not workflow:
             return None
 
+        prompt_inputs, seed_inputs = self.input_handles(workflow)
+
         # Modify prompt
-        workflow["input"]["workflow"]["6"]["inputs"]["text"] = prompt
+        prompt_inputs["text"] = prompt
 
         # Set seed if provided
-        if seed:
-            workflow["input"]["workflow"]["3"]["inputs"]["seed"] = seed
+        if seed is not None:
+            seed_inputs["seed"] = seed
+
+        # Tag the request so its execution events are routed to our websocket
+        workflow["client_id"] = self.client_id
+        return workflow
+
+    def submit(self, prompt, seed=None, workflow_file="../example-request.json", bypass_cache=False):
+        """Queue a generation without waiting for it; returns the prompt_id or None"""
+        print(f"🎨 Generating image: {prompt[:50]}...")
+
+        workflow = self.build_request(prompt, seed, workflow_file)
+        if not workflow:
+            return None
+
+        # Identical requests produce identical images; reuse the earlier result
+        if not bypass_cache:
+            prompt_id = self.cached_prompt_id(workflow)
+            if prompt_id:
+                return prompt_id
+
+        # Open a pooled connection with a cheap request so the first POST doesn't pay
+        # for the TCP handshake; a failure here is reported by the POST itself
+        if not self._warmed_up:
+            self._warmed_up = True
+            try:
+                self.session.get(f"{self.base_url}/system_stats", timeout=5).close()
+            except requests.exceptions.RequestException:
+                pass
+
+        # Subscribe before submitting so no events are missed
+        self.connect_websocket()
 
         # Submit generation request
         try:
             response = self.session.post(
                 f"{self.base_url}/prompt",
-                json=workflow,
+                data=orjson.dumps(workflow),
+                headers={"Content-Type": "application/json"},
                 timeout=10
             )
 
             if response.status_code == 200:
-                prompt_id = response.json()["prompt_id"]
+                prompt_id = orjson.loads(response.content)["prompt_id"]
                 print(f"✅ Generation started with ID: {prompt_id}")
-                return self.wait_for_completion(prompt_id)
+                self._submitted[prompt_id] = time.monotonic()
+                self.remember(workflow, prompt_id)
+                return prompt_id
             else:
                 print(f"❌ Error submitting request: {response.status_code}")
-                print(f"Response: {response.text}")
+                # Error pages can be large; show only the start, undecoded
+                print(f"Response: {response.content[:512]!r}")
                 return None
 
         except requests.exceptions.RequestException as e:
             print(f"❌ Network error: {e}")
             return None
 
+    def generate_image(self, prompt, seed=None, workflow_file="../example-request.json", bypass_cache=False):
+        """Generate an image from text prompt"""
+        prompt_id = self.submit(prompt, seed, workflow_file, bypass_cache)
+        if not prompt_id:
+            return None
+        return self.wait_for_completion(prompt_id)
+
+    def extract_images(self, history, prompt_id):
+        """Return the first output image list for prompt_id in a /history payload, else None"""
+        if prompt_id in history:
+            outputs = history[prompt_id].get("outputs", {})
+
+            # Extract image information
+            for node_id, node_output in outputs.items():
+                if node_output.get("images"):
+                    return node_output["images"]
+        return None
+
+    def execution_time(self, status):
+        """Seconds ComfyUI spent executing a prompt, from its history status messages, else None"""
+        timestamps = {event: data.get("timestamp") for event, data in status.get("messages", [])}
+        start, end = timestamps.get("execution_start"), timestamps.get("execution_success")
+        if start is None or end is None:
+            return None
+        return (end - start) / 1000
+
+    def get_history(self, prompt_id):
+        """Return the /history payload for prompt_id; empty until it has finished"""
+        # Stream so the (gzip-decoded) body is read once into bytes and parsed directly,
+        # and the connection is returned to the pool even when the status isn't 200
+        with self.session.get(
+            f"{self.base_url}/history/{prompt_id}",
+            timeout=5,
+            stream=True
+        ) as response:
+            if response.status_code == 200:
+                return orjson.loads(response.raw.read(decode_content=True))
+        return {}
+
+    def wait_for_events(self, prompt_id, deadline):
+        """Block on /ws until prompt_id finishes; returns True, False on error, None on timeout"""
+        # Another wait may already have read this prompt's final event
+        if self._finished.get(prompt_id) is not None:
+            return self._take_outcome(prompt_id)
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self.ws.settimeout(remaining)
+            try:
+                frame = self.ws.recv()
+            except websocket.WebSocketTimeoutException:
+                return None
+
+            # Binary frames carry latent previews; only text frames are events
+            if not isinstance(frame, str):
+                continue
+            message = orjson.loads(frame)
+            data = message.get("data", {})
+
+            # "executing" with no node means the whole prompt has finished
+            if message["type"] == "executing" and data.get("node") is None:
+                finished = True
+            elif message["type"] == "execution_error":
+                print(f"❌ Execution error: {data.get('exception_message', 'unknown')}")
+                finished = False
+            elif message["type"] == "execution_interrupted":
+                print("❌ Execution interrupted")
+                finished = False
+            else:
+                continue
+
+            # ComfyUI follows an error or interrupt with the usual final "executing" event,
+            # so the first outcome recorded for a prompt is the one that counts
+            event_prompt_id = data.get("prompt_id")
+            recorded = self._finished.setdefault(event_prompt_id, finished)
+            if event_prompt_id != prompt_id:
+                # Another of our prompts finished, so the queue is moving: restart the stall timeout
+                deadline = time.monotonic() + self.timeout
+                continue
+            return self._take_outcome(prompt_id)
+
+    def _take_outcome(self, prompt_id):
+        """Hand out a recorded outcome; failures leave a None marker that absorbs the trailing event"""
+        finished = self._finished.pop(prompt_id)
+        if not finished:
+            self._finished[prompt_id] = None
+        return finished
+
     def wait_for_completion(self, prompt_id):
         """Wait for generation to complete and return result"""
-        start_time = time.time()
+        if self.cache is not None and prompt_id in self.cache:
+            # Flag reused results so they aren't reported as fresh generations
+            return {**self.cache[prompt_id], "cached": True}
+
+        start_time = self._submitted.pop(prompt_id, None) or time.monotonic()
+        # A stall timeout: the websocket wait restarts it whenever another queued prompt finishes
+        deadline = time.monotonic() + self.timeout
 
-        while time.time() - start_time < self.timeout:
+        if self.ws is not None:
             try:
-                response = self.session.get(
-                    f"{self.base_url}/history/{prompt_id}",
-                    timeout=5
-                )
+                finished = self.wait_for_events(prompt_id, deadline)
+            except (websocket.WebSocketException, OSError) as e:
+                # Connection dropped; poll for whatever time is left
+                print(f"⚠️  WebSocket closed, polling for results instead: {e}")
+                self.close_websocket()
+            else:
+                if finished is None:
+                    return self.timeout_result(prompt_id)
+                if not finished:
+                    return {
+                        "prompt_id": prompt_id,
+                        "generation_time": time.monotonic() - start_time,
+                        "success": False,
+                        "error": "execution error"
+                    }
 
-                if response.status_code == 200:
-                    history = response.json()
+        # Start fast so short generations return promptly, then back off to 1s
+        delay = 0.05
+        while time.monotonic() < deadline:
+            try:
+                history = self.get_history(prompt_id)
+                images = self.extract_images(history, prompt_id)
+                if images:
+                    # Time since submission includes waiting behind earlier prompts;
+                    # prefer the execution time the server recorded
+                    generation_time = self.execution_time(history[prompt_id].get("status", {}))
+                    if generation_time is None:
+                        generation_time = time.monotonic() - start_time
+                    return self.store_result({
+                        "prompt_id": prompt_id,
+                        "images": images,
+                        "generation_time": generation_time,
+                        "success": True
+                    })
 
-                    if prompt_id in history:
-                        generation_data = history[prompt_id]
-                        outputs = generation_data.get("outputs", {})
+                delay = min(1.0, delay * 1.7)
 
-                        # Extract image information
-                        for node_id, node_output in outputs.items():
-                            if "images" in node_output:
-                                images = node_output["images"]
-                                if images:
-                                    generation_time = time.time() - start_time
-                                    return {
-                                        "prompt_id": prompt_id,
-                                        "images": images,
-                                        "generation_time": generation_time,
-                                        "success": True
-                                    }
+            except requests.exceptions.RequestException as e:
+                # Retry quickly once the server is reachable again
+                print(f"⚠️  Error checking status, retrying: {e}")
+                delay = 0.05
 
-                time.sleep(1)  # Poll every second
+            time.sleep(delay + random.uniform(0, delay * 0.1))
 
-            except requests.exceptions.RequestException as e:
-                print(f"❌ Error checking status: {e}")
-                break
+        return self.timeout_result(prompt_id)
 
+    def timeout_result(self, prompt_id):
+        """Result reported when a generation does not finish within self.timeout"""
         print(f"⏰ Generation timeout after {self.timeout} seconds")
         return {
             "prompt_id": prompt_id,
@@ -110,34 +393,30 @@ class QwenImageGenerator:
             "error": "timeout"
         }
 
+    def _resolve_path(self, image_info):
+        """Locate one output image on disk and describe it"""
+        filename = image_info['filename']
+        image_path = next((str(d / filename) for d in self._OUTPUT_DIRS if filename in _list_dir(d)), None)
+
+        return {
+            "filename": image_info["filename"],
+            "path": image_path,
+            "size": image_info.get("size", {}),
+            "subfolder": image_info.get("subfolder", ""),
+            "type": image_info.get("type", "output")
+        }
+
     def get_image_info(self, result):
         """Get information about generated images"""
         if not result or not result["success"]:
             return None
 
-        images = []
-        for image_info in result["images"]:
-            # Common output paths (adjust based on your ComfyUI setup)
-            possible_paths = [
-                f"../output/{image_info['filename']}",
-                f"output/{image_info['filename']}",
-                f"/comfyui/output/{image_info['filename']}",
-                image_info['filename']
-            ]
-
-            image_path = None
-            for path in possible_paths:
-                if os.path.exists(path):
-                    image_path = path
-                    break
-
-            images.append({
-                "filename": image_info["filename"],
-                "path": image_path,
-                "size": image_info.get("size", {}),
-                "subfolder": image_info.get("subfolder", ""),
-                "type": image_info.get("type", "output")
-            })
+        # List each directory once per result rather than probing every candidate path;
+        # drop older listings so images written since then are found
+        _list_dir.cache_clear()
+
+        # Resolve images in parallel so slow (e.g. network) filesystems aren't probed serially
+        images = list(self._io_pool.map(self._resolve_path, result["images"]))
 
         return {
             "prompt_id": result["prompt_id"],
@@ -145,41 +424,52 @@ class QwenImageGenerator:
             "images": images
         }
 
+def print_result(generator, result):
+    """Print one example's outcome"""
+    if result and result["success"]:
+        image_info = generator.get_image_info(result)
+        if image_info:
+            if result.get("cached"):
+                print(f"♻️  Reused {len(image_info['images'])} cached image(s) from an earlier run")
+            else:
+                print(f"✅ Generated {len(image_info['images'])} image(s) in {result['generation_time']:.2f}s")
+            for img in image_info['images']:
+                if img['path']:
+                    print(f"   📁 {img['filename']} -> {img['path']}")
+                else:
+                    print(f"   📁 {img['filename']} (path not found)")
+        else:
+            print("❌ No images found in output")
+    else:
+        print(f"❌ Generation failed: {(result or {}).get('error', 'Unknown error')}")
+
 def main():
     """Quick start example"""
     print("🚀 Qwen Image 8-Step Quick Start")
     print("=" * 50)
 
     # Initialize generator
-    generator = QwenImageGenerator()
-
-    # Example prompts
-    example_prompts = [
-        "A serene mountain landscape at sunset with golden light",
-        "A futuristic cyberpunk city with neon lights and flying cars",
-        "A traditional Japanese garden with cherry blossoms in spring",
-        "A cozy library with ancient books and warm lighting",
-        "A vibrant Hong Kong street with Chinese signs and lanterns"
-    ]
-
-    # Generate images
-    for i, prompt in enumerate(example_prompts, 1):
-        print(f"\n--- Example {i} ---")
-        result = generator.generate_image(prompt, seed=42 + i)
-
-        if result and result["success"]:
-            image_info = generator.get_image_info(result)
-            if image_info:
-                print(f"✅ Generated {len(image_info['images'])} image(s) in {result['generation_time']:.2f}s")
-                for img in image_info['images']:
-                    if img['path']:
-                        print(f"   📁 {img['filename']} -> {img['path']}")
-                    else:
-                        print(f"   📁 {img['filename']} (path not found)")
-            else:
-                print("❌ No images found in output")
-        else:
-            print(f"❌ Generation failed: {result.get('error', 'Unknown error')}")
+    with QwenImageGenerator() as generator:
+        # Example prompts
+        example_prompts = [
+            "A serene mountain landscape at sunset with golden light",
+            "A futuristic cyberpunk city with neon lights and flying cars",
+            "A traditional Japanese garden with cherry blossoms in spring",
+            "A cozy library with ancient books and warm lighting",
+            "A vibrant Hong Kong street with Chinese signs and lanterns"
+        ]
+
+        # Queue every prompt up front so the server never idles between generations
+        pending = [
+            (i, generator.submit(prompt, seed=42 + i))
+            for i, prompt in enumerate(example_prompts, 1)
+        ]
+
+        # Collect results in order; later prompts keep running on the server meanwhile
+        for i, prompt_id in pending:
+            print(f"\n--- Example {i} ---")
+            result = generator.wait_for_completion(prompt_id) if prompt_id else None
+            print_result(generator, result)
 
     print(f"\n🎉 Quick start completed!")
     print("Check your output directory for generated images.")